@@ -2,7 +2,9 @@
 Functions for reading CT scan dicom files
 """
 
+import concurrent.futures
 import pathlib
+from typing import Optional
 
 import numpy as np
 import pydicom
@@ -13,7 +15,8 @@ def get_image_from_dicom(dicom_file_path: str) -> np.ndarray:
     Reads a CT scan dicom file and generates an image array exactly like the BM-segmenter software generates it.
     """
     dicom_file_data = pydicom.dcmread(dicom_file_path)
-    image = np.array(dicom_file_data.pixel_array, dtype=np.int16)
+    # pixel_array is decoded for this dataset only, so it can be modified in place when it is already int16
+    image = dicom_file_data.pixel_array.astype(np.int16, copy=False)
 
     # this is the code used by the bm-segmenter software to get an image from a dicom
     image[image == -2000] = 0
@@ -22,14 +25,43 @@ def get_image_from_dicom(dicom_file_path: str) -> np.ndarray:
     slope = dicom_file_data.RescaleSlope
 
     if slope != 1:
-        image = slope * image.astype(np.float64)
-        image = image.astype(np.int16)
+        if float(slope).is_integer():
+            image *= np.int16(slope)
+        else:
+            scaled_image = image.astype(np.float64)
+            scaled_image *= slope
+            image = scaled_image.astype(np.int16)
 
+    # the intercept must be added after the conversion to int16 : adding it before the truncation would give different
+    # values for the pixels whose scaled value is not an integer
     image += np.int16(intercept)
 
     return image
 
 
+def get_images_from_dicoms(dicom_file_paths: list[str], max_workers: Optional[int] = None) -> list[np.ndarray]:
+    """
+    Same as `get_image_from_dicom` for several dicom files, which are decoded in parallel. The images are returned in
+    the same order as the file paths.
+
+    The files with compressed pixel data are decoded in worker processes, because some decoders hold the GIL. The other
+    files are read in threads.
+    """
+    is_compressed = [
+        pydicom.filereader.read_file_meta_info(dicom_file_path).TransferSyntaxUID.is_compressed
+        for dicom_file_path in dicom_file_paths
+    ]
+    compressed_file_paths = [path for path, compressed in zip(dicom_file_paths, is_compressed) if compressed]
+    uncompressed_file_paths = [path for path, compressed in zip(dicom_file_paths, is_compressed) if not compressed]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as process_executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as thread_executor:
+            compressed_images = process_executor.map(get_image_from_dicom, compressed_file_paths)
+            uncompressed_images = thread_executor.map(get_image_from_dicom, uncompressed_file_paths)
+            return [next(compressed_images) if compressed else next(uncompressed_images)
+                    for compressed in is_compressed]
+
+
 def get_dicom_path_from_case_path(case_directory_path: pathlib.Path) -> pathlib.Path:
     """
     It seems that the dicom files are often provided in a specific directory structure.
@@ -1,10 +1,21 @@
+import collections
+import concurrent.futures
+import functools
 import sys
 import pathlib
 from bms_project_edition import project
 
-sys.path.append(str(pathlib.Path(__file__).parent.parent / 'mlsegmentation'))
-sys.path.append(str(pathlib.Path(__file__).parent.parent / 'mlsegmentation' / 'src'))
-import final_model
+
+@functools.lru_cache(maxsize=1)
+def _load_final_model():
+    """
+    Imports the ml model module. This is done only when a prediction is needed, because importing it loads the whole
+    ml stack.
+    """
+    sys.path.append(str(pathlib.Path(__file__).parent.parent / 'mlsegmentation'))
+    sys.path.append(str(pathlib.Path(__file__).parent.parent / 'mlsegmentation' / 'src'))
+    import final_model
+    return final_model
 
 
 def compute_mask_predictions_from_ml_model(project_path: str, mask_name: str) -> None:
@@ -13,7 +24,21 @@ def compute_mask_predictions_from_ml_model(project_path: str, mask_name: str) ->
     """
     bms_project = project.Project(pathlib.Path(project_path))
 
-    images = [element.image() for element in bms_project.elements()]
-    predicted_masks = final_model.predict_from_images_iterable(images)
-    for element, predicted_mask in zip(bms_project.elements(), predicted_masks):
-        element.set_predicted_mask(predicted_mask=predicted_mask, mask_name=mask_name)
+    elements = bms_project.elements()
+    images = bms_project.images_iterable(elements, prefetch_count=4)
+    predicted_masks = _load_final_model().predict_from_images_iterable(images)
+
+    # The masks are saved in a background thread, so that the model does not wait for the disk between two images.
+    # At most `max_pending_saves` masks wait to be saved, so that the masks do not pile up in memory if the disk is
+    # slower than the model.
+    max_pending_saves = 2
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        save_futures = collections.deque()
+        for element, predicted_mask in zip(elements, predicted_masks):
+            save_futures.append(
+                executor.submit(element.set_predicted_mask, predicted_mask=predicted_mask, mask_name=mask_name)
+            )
+            if len(save_futures) > max_pending_saves:
+                save_futures.popleft().result()
+        for save_future in save_futures:
+            save_future.result()
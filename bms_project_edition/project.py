@@ -58,14 +58,87 @@ they contain. The group feature does not seem to be often used by the actual use
     - users : a list of the users that have validated the segmentation
 
 """
-import csv
+import collections
+import concurrent.futures
+import copy
 import datetime
+import os
 import pathlib
-import sys
+import struct
+import zipfile
+from collections.abc import Callable, Iterable, Iterator
+from typing import Optional
 
 import numpy as np
 import toml
 
+def _load_npz_array(npz_file_path: pathlib.Path, key: str) -> np.ndarray:
+    """
+    Reads an array of a npz file.
+
+    If the array is stored uncompressed in the archive (np.savez does so), it is memory-mapped instead of being read :
+    its content is loaded from the disk only when it is accessed. The mapping is copy-on-write, modifying the array does
+    not modify the file.
+    """
+    with zipfile.ZipFile(npz_file_path) as npz_file:
+        member = npz_file.getinfo(key + ".npy")
+
+    # encrypted members (flag bit 0) cannot be memory-mapped
+    if member.compress_type == zipfile.ZIP_STORED and not member.flag_bits & 0x1:
+        with open(npz_file_path, "rb") as npz_file_descriptor:
+            # The zip local file header is followed by the file name, an extra field and the npy file. Its fields are
+            # (signature, ..., file name length, extra field length).
+            npz_file_descriptor.seek(member.header_offset)
+            local_file_header = struct.unpack(zipfile.structFileHeader,
+                                              npz_file_descriptor.read(struct.calcsize(zipfile.structFileHeader)))
+            signature = local_file_header[0]
+            name_length, extra_field_length = local_file_header[10], local_file_header[11]
+
+            if signature == zipfile.stringFileHeader:
+                npz_file_descriptor.seek(name_length + extra_field_length, 1)
+                version = np.lib.format.read_magic(npz_file_descriptor)
+                if version in ((1, 0), (2, 0)):
+                    read_array_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                                         else np.lib.format.read_array_header_2_0)
+                    shape, fortran_order, dtype = read_array_header(npz_file_descriptor)
+                    if not dtype.hasobject and np.prod(shape) > 0:
+                        return np.memmap(npz_file_path, dtype=dtype, mode="c", shape=shape,
+                                         order="F" if fortran_order else "C", offset=npz_file_descriptor.tell())
+
+    with np.load(npz_file_path) as npz_file:
+        return npz_file[key]
+
+
+def _advise_will_need(file_path: pathlib.Path) -> None:
+    """
+    Asks the kernel to start reading a file in the background. Does nothing where posix_fadvise is not available.
+    """
+    if hasattr(os, "posix_fadvise"):
+        file_descriptor = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(file_descriptor, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(file_descriptor)
+
+
+def _prefetched(function: Callable, items: Iterable, prefetch_count: int = 1) -> Iterator:
+    """
+    Yields `function(item)` for each item, in order.
+
+    While the caller uses a value, the next `prefetch_count` values are computed in background threads.
+    `prefetch_count` must be at least 1.
+    """
+    if prefetch_count < 1:
+        raise ValueError("prefetch_count must be at least 1")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=prefetch_count) as executor:
+        futures = collections.deque()
+        for item in items:
+            futures.append(executor.submit(function, item))
+            if len(futures) > prefetch_count:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
 
 class ProjectElement:
     """
@@ -77,19 +150,38 @@ class ProjectElement:
         self.name = element_name
 
         self._image_file_data_cache = None
+        self._image_directory_path = project.images_directory() / element_name
+        self._mask_file_paths = {}
 
     def name_prefix(self) -> str:
-        return self.name.split('___')[0]
+        return self.name.split('___', 1)[0]
 
     # image data
 
     def image_directory_path(self) -> pathlib.Path:
-        return self.project.images_directory() / self.name
+        return self._image_directory_path
+
+    def image_file_path(self) -> pathlib.Path:
+        return self.image_directory_path() / "0.npz"
+
+    def read_image_file_data(self) -> dict:
+        """
+        Reads the image file, without using or filling the cache of `image_file_data`.
+
+        The HU matrix is memory-mapped when possible, the file stays mapped as long as the matrix is referenced. This
+        is meant for reading the images one after the other, like `Project.images_iterable` does.
+        """
+        image_file_path = self.image_file_path()
+        with np.load(image_file_path, allow_pickle=True) as image_file:
+            image_file_data = {key: image_file[key] for key in image_file.files if key != "matrix"}
+        image_file_data["matrix"] = _load_npz_array(image_file_path, "matrix")
+        return image_file_data
 
     def image_file_data(self):
-        # This cache is only to avoid performance issues
+        # This cache is only to avoid performance issues. The matrix is loaded in memory : keeping a memory-mapped
+        # matrix for each element would keep as many files open.
         if self._image_file_data_cache is None:
-            self._image_file_data_cache = dict(np.load(self.image_directory_path() / "0.npz", allow_pickle=True))
+            self._image_file_data_cache = dict(np.load(self.image_file_path(), allow_pickle=True))
 
         return self._image_file_data_cache
 
@@ -102,28 +194,94 @@ class ProjectElement:
     # mask data
 
     def mask_file_path(self, mask_name: str) -> pathlib.Path:
-        return self.project.masks_directory() / mask_name / (self.name + ".npz")
+        if mask_name not in self._mask_file_paths:
+            self._mask_file_paths[mask_name] = self.project.masks_directory() / mask_name / (self.name + ".npz")
+        return self._mask_file_paths[mask_name]
+
+    def mask_file_exists(self, mask_name: str) -> bool:
+        return self.mask_file_path(mask_name).name in self.project.mask_file_names(mask_name)
 
     def mask_file_data(self, mask_name: str) -> dict:
         mask_file_path = self.mask_file_path(mask_name)
-        if not mask_file_path.exists():
+        if not self.mask_file_exists(mask_name):
             raise FileNotFoundError(mask_file_path, "does not exist")
         return dict(np.load(mask_file_path, allow_pickle=True))
 
+    def mask_file_handle(self, mask_name: str, allow_pickle: bool = False) -> np.lib.npyio.NpzFile:
+        """
+        Opens the mask file. An array is read from the file only when it is accessed with `mask_file[key]`.
+
+        The handle must be closed after use, for example with a `with` statement.
+        """
+        mask_file_path = self.mask_file_path(mask_name)
+        if not self.mask_file_exists(mask_name):
+            raise FileNotFoundError(mask_file_path, "does not exist")
+        return np.load(mask_file_path, allow_pickle=allow_pickle)
+
+    def mask_file_array(self, mask_name: str, key: str) -> np.ndarray:
+        """
+        Reads a single array of the mask file.
+
+        Contrary to `mask_file_data`, only the requested array is read from the file.
+        """
+        try:
+            with self.mask_file_handle(mask_name) as mask_file:
+                return mask_file[key]
+        except ValueError:
+            # BM-segmenter may store some arrays as pickled python objects (e.g. the user list or an empty mask). Pickle
+            # is enabled only for these arrays.
+            with self.mask_file_handle(mask_name, allow_pickle=True) as mask_file:
+                return mask_file[key]
+
     def set_mask_file_data(self, mask_name: str, mask_file_data: dict):
         np.savez(self.mask_file_path(mask_name), **mask_file_data)
+        self.project.mask_file_names(mask_name).add(self.mask_file_path(mask_name).name)
+
+    def set_mask_file_array(self, mask_name: str, key: str, array: np.ndarray):
+        """
+        Replaces a single array of the mask file, creating the file if it does not exist.
+
+        The other members of the file are copied as they are stored in the archive. They are decompressed (if needed)
+        and written again with their original compression, but they are not decoded as numpy arrays or unpickled.
+        """
+        mask_file_path = self.mask_file_path(mask_name)
+        temporary_file_path = mask_file_path.with_name(mask_file_path.name + ".tmp")
+        member_name = key + ".npy"
+
+        try:
+            # the file is written with the same zip layout as np.savez
+            with zipfile.ZipFile(temporary_file_path, "w", allowZip64=True) as new_mask_file:
+                # The existence of the file is checked on the disk and not with `Project.mask_file_names` : if the file
+                # was created since the directory was listed, its other arrays must not be lost.
+                try:
+                    mask_file = zipfile.ZipFile(mask_file_path)
+                except FileNotFoundError:
+                    pass
+                else:
+                    with mask_file:
+                        for member in mask_file.infolist():
+                            if member.filename != member_name:
+                                new_mask_file.writestr(member, mask_file.read(member))
+                with new_mask_file.open(member_name, "w", force_zip64=True) as member_file:
+                    np.lib.format.write_array(member_file, np.asanyarray(array), allow_pickle=False)
+
+            temporary_file_path.replace(mask_file_path)
+        finally:
+            # the temporary file only remains if the write failed
+            temporary_file_path.unlink(missing_ok=True)
+        self.project.mask_file_names(mask_name).add(mask_file_path.name)
 
     def predicted_mask(self, mask_name: str) -> np.ndarray:
-        return self.mask_file_data(mask_name)["predicted"]
+        return self.mask_file_array(mask_name, "predicted")
 
     def current_mask(self, mask_name: str) -> np.ndarray:
-        return self.mask_file_data(mask_name)["current"]
+        return self.mask_file_array(mask_name, "current")
 
     def validated_mask(self, mask_name: str) -> np.ndarray:
-        return self.mask_file_data(mask_name)["validated"]
+        return self.mask_file_array(mask_name, "validated")
 
     def validators(self, mask_name: str) -> list[str]:
-        return self.mask_file_data(mask_name)["users"]
+        return self.mask_file_array(mask_name, "users")
 
     def is_validated(self, mask_name: str) -> bool:
         # It seems that in some situations:
@@ -136,12 +294,14 @@ class ProjectElement:
         else:
             result = len(validators) > 0
 
-        if result:
+        if __debug__ and result:
             # If the segmentation is validated, the validated mask should be equal to the current mask.
             # In the particular case where the predicted mask was validated without modification, the current mask is
             # empty.
-            assert (self.current_mask(mask_name).shape == ()
-                    or np.array_equal(self.validated_mask(mask_name), self.current_mask(mask_name)))
+            # This check reads two masks, it is skipped like the other assertions when python runs with -O.
+            with self.mask_file_handle(mask_name, allow_pickle=True) as mask_file:
+                current_mask = mask_file["current"]
+                assert current_mask.shape == () or np.array_equal(mask_file["validated"], current_mask)
         return result
 
     def mask_last_edit_time(self, mask_name: str) -> datetime.datetime:
@@ -149,12 +309,9 @@ class ProjectElement:
         return datetime.datetime.fromtimestamp(date_float)
 
     def set_predicted_mask(self, mask_name: str, predicted_mask: np.ndarray):
-        try:
-            mask_file_data = self.mask_file_data(mask_name)
-        except FileNotFoundError:
-            mask_file_data = {}
-        mask_file_data["predicted"] = predicted_mask.astype(np.uint8)
-        self.set_mask_file_data(mask_name=mask_name, mask_file_data=mask_file_data)
+        self.set_mask_file_array(
+            mask_name=mask_name, key="predicted", array=predicted_mask.astype(np.uint8, copy=False)
+        )
 
     def rename(self, new_name: str) -> None:
         image_directory_path = self.image_directory_path()
@@ -162,8 +319,15 @@ class ProjectElement:
 
         for mask_name in self.project.mask_names():
             mask_file_path = self.mask_file_path(mask_name)
-            if mask_file_path.exists():
-                mask_file_path.rename(mask_file_path.with_stem(new_name))
+            # the file is renamed if it exists on the disk, whatever `Project.mask_file_names` contains
+            new_mask_file_path = mask_file_path.with_stem(new_name)
+            try:
+                mask_file_path.rename(new_mask_file_path)
+            except FileNotFoundError:
+                continue
+            mask_file_names = self.project.mask_file_names(mask_name)
+            mask_file_names.discard(mask_file_path.name)
+            mask_file_names.add(new_mask_file_path.name)
 
         project_element_names = self.project.element_names()
         project_element_names.remove(self.name)
@@ -171,6 +335,8 @@ class ProjectElement:
         self.project.set_dataset_file_element_names(project_element_names)
 
         self.name = new_name
+        self._image_directory_path = self.project.images_directory() / new_name
+        self._mask_file_paths = {}
 
 
 class Project:
@@ -180,18 +346,45 @@ class Project:
 
     def __init__(self, project_path: pathlib.Path) -> None:
         self.path = project_path
+        self._images_directory = project_path / "data/dicoms"
+        self._masks_directory = project_path / "data/masks"
+        self._dataset_file_path = project_path / "dataset.toml"
+
+        self._dataset_file_data_cache = None
+        self._mask_names_cache = None
+        self._mask_file_names_cache = {}
 
     def images_directory(self) -> pathlib.Path:
-        return self.path / "data/dicoms"
+        return self._images_directory
 
     def masks_directory(self) -> pathlib.Path:
-        return self.path / "data/masks"
+        return self._masks_directory
 
     def dataset_file_path(self) -> pathlib.Path:
-        return self.path / "dataset.toml"
+        return self._dataset_file_path
 
     def mask_names(self) -> list[str]:
-        return [mask_file.stem for mask_file in self.masks_directory().iterdir()]
+        # This cache is only to avoid performance issues. The segmentations are created with the BM-segmenter
+        # software, this code never adds or removes a mask directory.
+        if self._mask_names_cache is None:
+            self._mask_names_cache = [mask_file.stem for mask_file in self.masks_directory().iterdir()]
+
+        return list(self._mask_names_cache)
+
+    def mask_file_names(self, mask_name: str) -> set[str]:
+        """
+        Returns the names of the files in the directory of a mask.
+
+        The directory is listed only once, then this set is kept up to date by the `ProjectElement` methods that create
+        or rename mask files. This avoids checking the existence of each mask file on the disk.
+        """
+        if mask_name not in self._mask_file_names_cache:
+            try:
+                self._mask_file_names_cache[mask_name] = set(os.listdir(self.masks_directory() / mask_name))
+            except FileNotFoundError:
+                self._mask_file_names_cache[mask_name] = set()
+
+        return self._mask_file_names_cache[mask_name]
 
     def element_names(self) -> list[str]:
         return self.dataset_file_data()["files"]
@@ -201,10 +394,41 @@ class Project:
 
         # sort in the same way as the BM-segmenter software
         def sorting_key(element: ProjectElement):
-            return len(element.name_prefix()), element.name_prefix()
+            name_prefix = element.name_prefix()
+            return len(name_prefix), name_prefix
 
         return sorted(result, key=sorting_key)
 
+    def image_file_data_iterable(
+            self, elements: Optional[list[ProjectElement]] = None, prefetch_count: int = 1
+    ) -> Iterator[dict]:
+        """
+        Yields the image file data of the elements (by default all the project elements), in order.
+
+        While the caller uses an image file data, the next `prefetch_count` ones are read in background threads. They
+        are read with `ProjectElement.read_image_file_data` and are not cached in the elements, so only a few of them
+        are in memory at the same time.
+        """
+        if elements is None:
+            elements = self.elements()
+
+        def read_image_file_data_ahead(element: ProjectElement) -> dict:
+            # The element has just entered the prefetch window. The matrix is memory-mapped, so the kernel is asked to
+            # read the file now, instead of when the caller first accesses the matrix.
+            _advise_will_need(element.image_file_path())
+            return element.read_image_file_data()
+
+        return _prefetched(read_image_file_data_ahead, elements, prefetch_count)
+
+    def images_iterable(
+            self, elements: Optional[list[ProjectElement]] = None, prefetch_count: int = 1
+    ) -> Iterator[np.ndarray]:
+        """
+        Same as `image_file_data_iterable`, but yields only the images.
+        """
+        for image_file_data in self.image_file_data_iterable(elements, prefetch_count):
+            yield image_file_data["matrix"]
+
     def set_dataset_file_element_names(self, element_names: list[str]):
         dataset_file_data = self.dataset_file_data()
 
@@ -215,8 +439,14 @@ class Project:
         self.set_dataset_file_data(dataset_file_data)
 
     def dataset_file_data(self):
-        return toml.load(self.dataset_file_path())
+        # This cache is only to avoid performance issues. Copies are returned and stored, so that the callers can
+        # modify the data without altering the cache.
+        if self._dataset_file_data_cache is None:
+            self._dataset_file_data_cache = toml.load(self.dataset_file_path())
+
+        return copy.deepcopy(self._dataset_file_data_cache)
 
     def set_dataset_file_data(self, dataset_file_data: dict):
         with self.dataset_file_path().open("w") as dataset_file_descriptor:
             toml.dump(dataset_file_data, dataset_file_descriptor)
+        self._dataset_file_data_cache = copy.deepcopy(dataset_file_data)
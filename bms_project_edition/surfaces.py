@@ -1,6 +1,8 @@
 import csv
 import pathlib
 
+import numpy as np
+
 from bms_project_edition import project
 
 
@@ -15,7 +17,8 @@ def write_measurement_csv_for_bmsegmenter_project(
     """
     bms_project = project.Project(pathlib.Path(project_path))
 
-    with open(bms_project.path / f"{mask_name}_measurements.csv", "w", newline='') as csv_file:
+    # a large buffer, so that the file is written in a few big writes instead of many small ones
+    with open(bms_project.path / f"{mask_name}_measurements.csv", "w", newline='', buffering=1 << 20) as csv_file:
         csv_writer = csv.writer(csv_file)
         csv_writer.writerow([
             "Name",
@@ -26,34 +29,43 @@ def write_measurement_csv_for_bmsegmenter_project(
             "IMAT (cm^2)"
         ])
 
-        for element in bms_project.elements():
+        elements = bms_project.elements()
+        is_validated = [element.is_validated(mask_name) for element in elements]
+        # the next images are read in background threads while the current one is used
+        validated_image_file_data = bms_project.image_file_data_iterable(
+            [element for element, element_is_validated in zip(elements, is_validated) if element_is_validated],
+            prefetch_count=4
+        )
+
+        for element, element_is_validated in zip(elements, is_validated):
 
-            if not element.is_validated(mask_name):
+            if not element_is_validated:
                 csv_writer.writerow([element.name_prefix(), "N/A", "N/A", "N/A", "N/A", "N/A"])
             else:
-                image = element.image()
+                image_file_data = next(validated_image_file_data)
+                image = image_file_data["matrix"]
                 project_mask = element.validated_mask(mask_name).astype(bool)
 
-                restricted_project_mask = (
-                        (image >= restricted_hu_range_min) &
-                        (image <= restricted_hu_range_max) &
-                        project_mask
-                )
-
-                imat_project_mask = (
-                        (image >= -190) &
-                        (image <= -31) &
-                        project_mask
+                # The pixels inside the mask are selected once, the other measurements only need these pixels
+                masked_image_values = image[project_mask]
+                restricted_image_values = masked_image_values[
+                    (masked_image_values >= restricted_hu_range_min) &
+                    (masked_image_values <= restricted_hu_range_max)
+                ]
+                imat_pixel_count = np.count_nonzero(
+                    (masked_image_values >= -190) &
+                    (masked_image_values <= -31)
                 )
 
-                pixel_area_cm2 = element.pixel_dimensions_mm()[0] * element.pixel_dimensions_mm()[1] / 100
+                pixel_width_mm, pixel_height_mm = image_file_data["spacing"]
+                pixel_area_cm2 = pixel_width_mm * pixel_height_mm / 100
 
-                project_mask_area = project_mask.sum() * pixel_area_cm2
-                restricted_project_mask_area = restricted_project_mask.sum() * pixel_area_cm2
-                imat_project_mask_area = imat_project_mask.sum() * pixel_area_cm2
+                project_mask_area = masked_image_values.size * pixel_area_cm2
+                restricted_project_mask_area = restricted_image_values.size * pixel_area_cm2
+                imat_project_mask_area = imat_pixel_count * pixel_area_cm2
 
-                project_mask_mean = image[project_mask].mean()
-                restricted_project_mask_mean = image[restricted_project_mask].mean()
+                project_mask_mean = masked_image_values.mean()
+                restricted_project_mask_mean = restricted_image_values.mean()
 
                 csv_writer.writerow([
                     element.name_prefix(),